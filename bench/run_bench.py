@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark the stages of code_extractor.py on synthetic and real conversations.
+
+For every corpus this times extract_markdown_code_blocks,
+extract_indented_code_blocks, language detection (CodeBlock._detect_language),
+save_code_block, the single-pass scan_content that extract_file uses, and
+extract_file end to end. Each stage reports the best of several repeats.
+
+    python bench/run_bench.py
+    python bench/run_bench.py --size 8 --repeat 5 --output bench_output.txt
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+from code_extractor import CodeExtractor  # noqa: E402
+from synthetic import generate_conversation  # noqa: E402
+
+REPO_CORPORA = [
+    'sample_conversation.md',
+    'demo_conversation.md',
+    'api_development_session.md',
+    'InProgress/Convo 1',
+]
+
+# name: keyword arguments for generate_conversation
+SYNTHETIC_PROFILES = {
+    'synthetic-mixed': {},
+    'synthetic-fenced': {'fence_ratio': 0.6, 'indented_ratio': 0.0},
+    'synthetic-indented': {'fence_ratio': 0.0, 'indented_ratio': 0.5},
+    'synthetic-prose': {'fence_ratio': 0.0, 'indented_ratio': 0.0},
+}
+
+
+def best_time(function: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    """Return the fastest of ``repeat`` runs of ``function``, in seconds, and its last result."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_corpus(name: str, path: Path, repeat: int) -> List[Dict]:
+    """Time every stage on one file and return a row per stage."""
+    extractor = CodeExtractor(write_threads=0)
+    content = path.read_text(encoding='utf-8')
+    size = len(content.encode('utf-8'))
+    rows = []
+
+    def add(stage: str, seconds: float, blocks: int, reads_text: bool = True):
+        rows.append({'corpus': name, 'bytes': size, 'stage': stage, 'seconds': seconds, 'blocks': blocks,
+                     'reads_text': reads_text})
+
+    seconds, fenced = best_time(lambda: extractor.extract_markdown_code_blocks(content), repeat)
+    add('extract_markdown_code_blocks', seconds, len(fenced))
+    seconds, indented = best_time(lambda: extractor.extract_indented_code_blocks(content), repeat)
+    add('extract_indented_code_blocks', seconds, len(indented))
+
+    blocks = fenced + indented
+    seconds, _ = best_time(lambda: [block._detect_language() for block in blocks], repeat)
+    add('_detect_language', seconds, len(blocks), reads_text=False)
+
+    seconds, (scanned, _) = best_time(lambda: extractor.scan_content(content), repeat)
+    add('scan_content', seconds, len(scanned))
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        topic_dir = Path(output_dir) / 'topic'
+        seconds, _ = best_time(lambda: [extractor.save_code_block(block, topic_dir, i)
+                                        for i, block in enumerate(scanned, 1)], repeat)
+        add('save_code_block', seconds, len(scanned), reads_text=False)
+
+    seconds, result = best_time(lambda: extractor.extract_file(str(path)), repeat)
+    add('extract_file', seconds, len(result.get('code_blocks', ())))
+    extractor.close()
+    return rows
+
+
+def format_rows(rows: List[Dict]) -> str:
+    """Format result rows as a table; MB/s is only given for stages that read the whole text."""
+    lines = [f"{'corpus':<26} {'KB':>6} {'stage':<29} {'ms':>9} {'MB/s':>7} {'blocks':>6} {'blocks/s':>9}"]
+    for row in rows:
+        seconds = max(row['seconds'], 1e-9)
+        throughput = f"{row['bytes'] / seconds / 1e6:.1f}" if row['reads_text'] else '-'
+        lines.append(f"{row['corpus']:<26} {row['bytes'] / 1024:>6.0f} {row['stage']:<29} "
+                     f"{row['seconds'] * 1000:>9.2f} {throughput:>7} "
+                     f"{row['blocks']:>6} {row['blocks'] / seconds:>9.0f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the code extraction pipeline')
+    parser.add_argument('--size', type=float, default=2.0,
+                       help='Size of each synthetic corpus in MB (default: 2)')
+    parser.add_argument('--repeat', type=int, default=3,
+                       help='Runs per stage; the fastest is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic corpora')
+    parser.add_argument('--no-synthetic', action='store_true', help='Skip the synthetic corpora')
+    parser.add_argument('--no-repo', action='store_true', help="Skip the repository's conversations")
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    rows = []
+    if not args.no_repo:
+        for name in REPO_CORPORA:
+            path = REPO_DIR / name
+            if path.exists():
+                rows.extend(bench_corpus(name, path, args.repeat))
+
+    if not args.no_synthetic:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            for name, profile in SYNTHETIC_PROFILES.items():
+                path = Path(corpus_dir) / f"{name}.md"
+                path.write_text(generate_conversation(int(args.size * 1024 * 1024), seed=args.seed, **profile),
+                                encoding='utf-8')
+                rows.extend(bench_corpus(name, path, args.repeat))
+
+    report = format_rows(rows)
+    print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
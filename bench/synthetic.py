@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Synthetic conversation exports for benchmarking code_extractor.py.
+
+Conversations mix prose, fenced code blocks and indented code blocks in
+controlled proportions, with code drawn from a chosen mix of languages.
+Output is deterministic for a given seed.
+"""
+
+import argparse
+import random
+from typing import Dict, List, Optional, Sequence
+
+SNIPPETS: Dict[str, List[str]] = {
+    'python': [
+        "import os\nfrom pathlib import Path\n\ndef list_files(root):\n    for path in Path(root).rglob('*'):\n        if path.is_file():\n            yield path\n\nprint(list(list_files('.')))",
+        "class Cache:\n    def __init__(self):\n        self.items = {}\n\n    def get(self, key, default=None):\n        return self.items.get(key, default)",
+    ],
+    'javascript': [
+        "const express = require('express');\nconst app = express();\n\napp.get('/api/users', async (req, res) => {\n    const users = await db.all('SELECT * FROM users');\n    res.json(users);\n});\n\nmodule.exports = app;",
+        "function debounce(fn, wait) {\n    let timer;\n    return (...args) => {\n        clearTimeout(timer);\n        timer = setTimeout(() => fn(...args), wait);\n    };\n}\nconsole.log(typeof debounce);",
+    ],
+    'sql': [
+        "CREATE TABLE orders (\n    id INTEGER PRIMARY KEY,\n    user_id INTEGER NOT NULL,\n    total REAL\n);\n\nSELECT u.name, SUM(o.total)\nFROM users u\nJOIN orders o ON o.user_id = u.id\nGROUP BY u.name\nORDER BY 2 DESC;",
+    ],
+    'bash': [
+        "#!/bin/bash\nset -euo pipefail\n\nfor file in *.log; do\n    echo \"Compressing $file\"\n    gzip \"$file\"\ndone",
+        "sudo apt-get update\nsudo apt-get install -y python3-pip\npip3 install -r requirements.txt\nexport APP_ENV=production",
+    ],
+    'html': [
+        "<!DOCTYPE html>\n<html>\n<head>\n    <title>Dashboard</title>\n</head>\n<body>\n    <div id=\"app\"></div>\n    <script src=\"app.js\"></script>\n</body>\n</html>",
+    ],
+    'css': [
+        ".card {\n    display: flex;\n    padding: 1rem;\n    border-radius: 4px;\n}\n\n@media (max-width: 600px) {\n    .card {\n        flex-direction: column;\n    }\n}",
+    ],
+    'json': [
+        "{\n    \"name\": \"extractor\",\n    \"version\": \"1.0.0\",\n    \"dependencies\": {\n        \"express\": \"^4.18.0\"\n    }\n}",
+    ],
+    'yaml': [
+        "version: '3'\nservices:\n  web:\n    image: nginx:latest\n    ports:\n      - \"80:80\"\n  db:\n    image: postgres:15",
+    ],
+    'java': [
+        "public class Main {\n    public static void main(String[] args) {\n        System.out.println(\"Hello\");\n    }\n}",
+    ],
+    'c': [
+        "#include <stdio.h>\n\nint main(void) {\n    printf(\"hello\\n\");\n    return 0;\n}",
+    ],
+}
+
+PROSE = [
+    "Sure, here is how I would approach it.",
+    "That makes sense, but what about the error handling in the second step?",
+    "You can run this once and then check the output directory for the results.",
+    "The main thing to watch out for is that the connection is closed afterwards.",
+    "Let me know if you want me to walk through the rest of the setup as well.",
+    "I tried that and it worked, although the first run was a bit slow.",
+]
+
+
+def generate_conversation(target_size: int, fence_ratio: float = 0.3, indented_ratio: float = 0.1,
+                          languages: Optional[Sequence[str]] = None, tagged_ratio: float = 0.5,
+                          seed: int = 0) -> str:
+    """Generate a conversation of about ``target_size`` characters.
+
+    Each section is a fenced block with probability ``fence_ratio``, an
+    indented block with probability ``indented_ratio`` and otherwise a
+    paragraph of prose. Fenced blocks carry a language tag with
+    probability ``tagged_ratio``.
+    """
+    rng = random.Random(seed)
+    languages = list(languages or SNIPPETS)
+    parts = ["# Synthetic Conversation\n"]
+    size = len(parts[0])
+    turn = 0
+    while size < target_size:
+        roll = rng.random()
+        if roll < fence_ratio:
+            language = rng.choice(languages)
+            tag = language if rng.random() < tagged_ratio else ''
+            part = f"```{tag}\n{rng.choice(SNIPPETS[language])}\n```\n"
+        elif roll < fence_ratio + indented_ratio:
+            snippet = rng.choice(SNIPPETS[rng.choice(languages)])
+            part = '\n'.join('    ' + line for line in snippet.split('\n')) + '\n'
+        else:
+            speaker = 'User' if turn % 2 == 0 else 'Assistant'
+            turn += 1
+            sentences = ' '.join(rng.choice(PROSE) for _ in range(rng.randint(1, 4)))
+            part = f"**{speaker}:** {sentences}\n"
+        parts.append(part)
+        parts.append('\n')
+        size += len(part) + 1
+    return ''.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic conversation export')
+    parser.add_argument('output', help='File to write')
+    parser.add_argument('--size', type=float, default=1.0, help='Approximate size in MB (default: 1)')
+    parser.add_argument('--fence-ratio', type=float, default=0.3)
+    parser.add_argument('--indented-ratio', type=float, default=0.1)
+    parser.add_argument('--languages', help='Comma-separated language mix (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    languages = args.languages.split(',') if args.languages else None
+    content = generate_conversation(int(args.size * 1024 * 1024), args.fence_ratio,
+                                    args.indented_ratio, languages, seed=args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+if __name__ == '__main__':
+    main()
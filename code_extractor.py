@@ -7,100 +7,1404 @@ into separate files organized by topic/conversation.
 """
 
 import os
+import sys
 import re
 import argparse
+import codecs
+import contextlib
+import ctypes
+import ctypes.util
+import signal
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+import glob
 import hashlib
+import http.server
+import io
+import select
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional, Union
 import json
+import mmap
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+try:
+    import xxhash
+except ImportError:  # Optional, for the xxh* hash algorithms
+    xxhash = None
+
+
+FENCED_BLOCK_PATTERN = re.compile(r'```(\w+)?\n(.*?)\n```', re.DOTALL)
+FENCE_OPEN_PATTERN = re.compile(r'```(\w+)?$')
+NEWLINE_PATTERN = re.compile(r'\n')
+
+# Title patterns in priority order: the first pattern that matches anywhere
+# in the file wins, regardless of where the other patterns match.
+TITLE_PATTERNS = [
+    re.compile(r'^#\s+(.+)$'),  # Markdown h1
+    re.compile(r'^##\s+(.+)$'),  # Markdown h2
+    re.compile(r'^Title:\s*(.+)$', re.IGNORECASE),  # Title: format
+    re.compile(r'^Subject:\s*(.+)$', re.IGNORECASE),  # Subject: format
+]
+TITLE_PREFIXES = ('#', 'T', 't', 'S', 's')
+
+DEFAULT_CONFIG_PATH = Path(__file__).resolve().with_name('config.json')
+
+# Files larger than the configured streaming threshold are read in chunks of this size
+STREAM_CHUNK_SIZE = 1 << 20
+# Characters of an open fence kept in memory when streaming; the rest go to a temporary file
+FENCE_SPILL_SIZE = 16 << 20
+
+# Patterns that suggest an indented block is code rather than prose
+CODE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in [
+        r'[a-zA-Z_]\w*\s*\(',  # Function calls
+        r'[a-zA-Z_]\w*\s*=',   # Variable assignments
+        r'\{[^}]*\}',          # Braces
+        r'["\'][^"\']*["\']',  # Quoted strings
+        r'//.*|/\*.*\*/|#.*',  # Comments
+        r'\w+\.\w+',           # Method calls
+        r'if\s*\(|while\s*\(|for\s*\(',  # Control structures
+        r'</?\w+[^>]*>',       # HTML tags
+        r'[a-zA-Z-]+:\s*[^;]+;',  # CSS properties
+    ]
+]
+
+
+class LanguageDetector:
+    """Scoring language classifier with its feature table compiled once up front.
+
+    ``patterns`` maps each language to a list of patterns or
+    ``[pattern, weight]`` pairs (weight 1 when omitted), matched with
+    MULTILINE and IGNORECASE; ``(?-i:...)`` makes a keyword case-sensitive.
+    Every distinct pattern is searched once per block and adds its weight
+    to each language that lists it. The best-scoring language wins, ties
+    going to the language listed first; its confidence combines its share
+    of the total score with how close its own evidence comes to
+    ``conclusive_score``. Below ``minimum_confidence`` the block is 'txt'.
+    """
+
+    def __init__(self, patterns: Dict[str, list], minimum_confidence: float = 0.0,
+                 conclusive_score: float = 1.0):
+        self.languages = list(patterns)
+        self.minimum_confidence = minimum_confidence
+        self.conclusive_score = conclusive_score
+        features = {}
+        for rank, (language, pattern_list) in enumerate(patterns.items()):
+            for entry in pattern_list:
+                pattern, weight = (entry, 1.0) if isinstance(entry, str) else entry
+                features.setdefault(pattern, []).append((rank, float(weight)))
+        self.features = [
+            (re.compile(pattern, re.MULTILINE | re.IGNORECASE), weights)
+            for pattern, weights in features.items()
+        ]
+
+    def classify(self, content: str) -> Tuple[str, float]:
+        """Return the most likely language and a confidence between 0 and 1."""
+        scores = [0.0] * len(self.languages)
+        for pattern, weights in self.features:
+            if pattern.search(content):
+                for rank, weight in weights:
+                    scores[rank] += weight
+
+        total = sum(scores)
+        if not total:
+            return 'txt', 0.0
+        best_score = max(scores)
+        rank = scores.index(best_score)
+        confidence = (best_score / total) * min(1.0, best_score / self.conclusive_score)
+        if confidence < self.minimum_confidence:
+            return 'txt', confidence
+        return self.languages[rank], confidence
+
+    def detect(self, content: str) -> str:
+        """Return the most likely language, or 'txt' when unsure."""
+        return self.classify(content)[0]
+
+
+class ExtractorConfig:
+    """Extractor settings from a config.json file, with every pattern compiled once."""
+
+    def __init__(self, settings: Dict, path: Optional[str] = None):
+        self.path = path
+        self.settings = settings
+        self.supported_extensions = tuple(ext.lower() for ext in settings['supported_extensions'])
+        self.output_directory = settings['output_directory']
+        self.minimum_code_block_size = settings['minimum_code_block_size']
+        self.minimum_indented_block_lines = settings['minimum_indented_block_lines']
+        self.minimum_indented_block_size = settings['minimum_indented_block_size']
+        self.language_extensions = settings['language_extensions']
+        # Empty files cannot be mapped, so they are never streamed
+        self.streaming_threshold = max(settings['streaming_threshold'], 0)
+        self.new_hash = hash_factory(settings['hash_algorithm'], settings.get('hash_digest_size'))
+        self.hash_length = settings['hash_length']
+        self.coalesce_block_size = settings['coalesce_block_size']
+        self.detector = LanguageDetector(settings['code_patterns'],
+                                         settings['minimum_language_confidence'],
+                                         settings['conclusive_language_score'])
+
+    def __reduce__(self):
+        # Pickle the settings themselves, as a config need not come from a file
+        return _restore_config, (self.settings, self.path)
+
+    def get_file_extension(self, language: str) -> str:
+        """Get appropriate file extension for a language."""
+        return self.language_extensions.get(language, '.txt')
+
+
+_loaded_configs: Dict[Optional[str], ExtractorConfig] = {}
+# Unpickled configs by their settings, so each process compiles each config once
+_restored_configs: Dict[str, ExtractorConfig] = {}
+
+
+def _restore_config(settings: Dict, path: Optional[str] = None) -> ExtractorConfig:
+    """Unpickle an ExtractorConfig, reusing one already loaded with the same settings."""
+    config = _loaded_configs.get(path)
+    if config is not None and config.settings == settings:
+        return config
+    key = json.dumps(settings, sort_keys=True)
+    config = _restored_configs.get(key)
+    if config is None:
+        config = _restored_configs[key] = ExtractorConfig(settings, path)
+    return config
+
+
+def hash_factory(algorithm: str, digest_size: Optional[int] = None):
+    """Return a constructor for hash objects of the named algorithm, like hashlib.sha256.
+
+    Any hashlib algorithm works; ``digest_size`` applies to blake2b and
+    blake2s. The xxh32/xxh64/xxh3_64/xxh3_128 algorithms need the xxhash
+    package.
+    """
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise ValueError(f"hash algorithm {algorithm} requires the xxhash package")
+        if not hasattr(xxhash, algorithm):
+            raise ValueError(f"unknown hash algorithm: {algorithm}")
+        return getattr(xxhash, algorithm)
+    if digest_size:
+        if algorithm not in ('blake2b', 'blake2s'):
+            raise ValueError(f"hash_digest_size is not supported by {algorithm}")
+        return partial(getattr(hashlib, algorithm), digest_size=digest_size)
+    hashlib.new(algorithm)  # Raises ValueError for unknown algorithms
+    return getattr(hashlib, algorithm, partial(hashlib.new, algorithm))
+
+
+def load_config(path: Optional[str] = None) -> ExtractorConfig:
+    """Load, compile and cache the configuration at ``path``.
+
+    Settings missing from ``path`` are taken from the config.json shipped
+    next to this script, which is also what ``path=None`` loads. Every
+    caller asking for the same path shares one ExtractorConfig.
+    """
+    if path in _loaded_configs:
+        return _loaded_configs[path]
+
+    with open(DEFAULT_CONFIG_PATH, 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    if path is not None:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f))
+
+    config = _loaded_configs[path] = ExtractorConfig(settings, path)
+    return config
 
 
 class CodeBlock:
-    """Represents a code block with metadata."""
+    """Represents a code block with metadata.
+
+    The block's text is ``content`` stripped. When ``source`` is given,
+    ``content`` must be the slice of it starting at ``offset``; the block
+    then keeps a reference to ``source`` and the offsets of its text
+    rather than a copy, and ``content`` is sliced out on access. The hash
+    is computed when first needed. Pickled blocks carry only their own text.
+    """
+
+    __slots__ = ('config', 'language', 'confidence', 'start_line', 'end_line',
+                 '_source', '_start', '_end', '_digest')
     
-    def __init__(self, content: str, language: str = None, start_line: int = 0):
-        self.content = content.strip()
-        self.language = language or self._detect_language()
+    def __init__(self, content: str, language: str = None, start_line: int = 0,
+                 config: Optional[ExtractorConfig] = None, end_line: Optional[int] = None,
+                 confidence: Optional[float] = None, source: Optional[str] = None, offset: int = 0):
+        self.config = config or load_config()
+        stripped = content.strip()
+        if source is None:
+            source, offset = stripped, 0
+        elif stripped:
+            # Leading whitespace ends at the first character of the stripped text
+            offset += content.find(stripped[0])
+        self._source, self._start, self._end = source, offset, offset + len(stripped)
+        self._digest = None
+        if language:
+            # A language given without a confidence, such as a fence's tag, is certain
+            self.language, self.confidence = language, 1.0 if confidence is None else confidence
+        else:
+            self.language, self.confidence = self._classify_language()
         self.start_line = start_line
-        self.hash = hashlib.md5(self.content.encode()).hexdigest()[:8]
+        # Last line of the block in the source, including any closing fence
+        self.end_line = start_line if end_line is None else end_line
+
+    @property
+    def content(self) -> str:
+        return self._source[self._start:self._end]
+
+    @property
+    def digest(self) -> str:
+        """Hex digest of the content with the configured hash algorithm."""
+        if self._digest is None:
+            self._digest = self.config.new_hash(self.content.encode()).hexdigest()
+        return self._digest
+
+    @property
+    def hash(self) -> str:
+        """The digest shortened to the configured hash_length, as used in file names."""
+        return self.digest[:self.config.hash_length]
+
+    def __getstate__(self):
+        return (self.config, self.language, self.confidence, self.start_line, self.end_line,
+                self.content, self._digest)
+
+    def __setstate__(self, state):
+        (self.config, self.language, self.confidence, self.start_line, self.end_line,
+         content, self._digest) = state
+        self._source, self._start, self._end = content, 0, len(content)
     
     def _detect_language(self) -> str:
         """Detect programming language from content."""
-        content_lower = self.content.lower()
-        
-        # Common patterns for language detection
-        patterns = {
-            'python': [r'def\s+\w+\(', r'import\s+\w+', r'from\s+\w+\s+import', r'print\s*\(', r'class\s+\w+'],
-            'javascript': [r'function\s+\w+\(', r'const\s+\w+\s*=', r'let\s+\w+\s*=', r'console\.log\(', r'document\.'],
-            'java': [r'public\s+class\s+\w+', r'public\s+static\s+void\s+main', r'System\.out\.print'],
-            'c': [r'#include\s*<', r'int\s+main\s*\(', r'printf\s*\('],
-            'cpp': [r'#include\s*<', r'std::', r'cout\s*<<'],
-            'html': [r'<html', r'<div', r'<body', r'<!DOCTYPE'],
-            'css': [r'\w+\s*\{[^}]*\}', r'@media', r'\.[\w-]+\s*\{'],
-            'sql': [r'SELECT\s+', r'FROM\s+', r'WHERE\s+', r'INSERT\s+INTO'],
-            'bash': [r'#!/bin/bash', r'echo\s+', r'\$\w+', r'if\s*\[\s*'],
-            'dockerfile': [r'FROM\s+\w+', r'RUN\s+', r'COPY\s+', r'WORKDIR\s+', r'EXPOSE\s+', r'CMD\s*\['],
-            'json': [r'^\s*\{', r'^\s*\[', r'"\w+":\s*'],
-            'yaml': [r'^\w+:', r'^\s*-\s+\w+'],
-            'xml': [r'<\?xml', r'<\w+.*>.*</\w+>']
-        }
-        
-        for lang, pattern_list in patterns.items():
-            for pattern in pattern_list:
-                if re.search(pattern, self.content, re.MULTILINE | re.IGNORECASE):
-                    return lang
-        
-        return 'txt'
+        return self.config.detector.detect(self.content)
+
+    def _classify_language(self) -> Tuple[str, float]:
+        """Detect programming language from content, with a confidence."""
+        return self.config.detector.classify(self.content)
     
     def get_file_extension(self) -> str:
         """Get appropriate file extension for the language."""
-        extensions = {
-            'python': '.py',
-            'javascript': '.js',
-            'java': '.java',
-            'c': '.c',
-            'cpp': '.cpp',
-            'html': '.html',
-            'css': '.css',
-            'sql': '.sql',
-            'bash': '.sh',
-            'dockerfile': '.dockerfile',
-            'json': '.json',
-            'yaml': '.yml',
-            'xml': '.xml',
-            'txt': '.txt'
+        return self.config.get_file_extension(self.language)
+
+
+class SpooledBlock:
+    """A code block whose content was written to a BlockSpool instead of kept in memory.
+
+    It has the attributes of the CodeBlock it replaces; ``content`` is read
+    back from the spool file on access.
+    """
+
+    def __init__(self, block: CodeBlock, path: str, offset: int, length: int):
+        self.config = block.config
+        self.language = block.language
+        self.confidence = block.confidence
+        self.start_line = block.start_line
+        self.end_line = block.end_line
+        self.digest = block.digest
+        self.hash = block.hash
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    @property
+    def content(self) -> str:
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return f.read(self.length).decode('utf-8')
+
+    def get_file_extension(self) -> str:
+        """Get appropriate file extension for the language."""
+        return self.config.get_file_extension(self.language)
+
+
+class BlockSpool:
+    """Temporary file holding the contents of code blocks from a streamed file."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='code_extractor-', suffix='.spool')
+        self._file = os.fdopen(fd, 'wb')
+        self._offset = 0
+
+    def add(self, block: CodeBlock) -> SpooledBlock:
+        """Write a block's content to the spool and return its spooled stand-in."""
+        data = block.content.encode('utf-8')
+        self._file.write(data)
+        spooled = SpooledBlock(block, self.path, self._offset, len(data))
+        self._offset += len(data)
+        return spooled
+
+    def close(self):
+        """Finish writing, so the spooled contents can be read."""
+        self._file.close()
+
+    def remove(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SpilledLines:
+    """Lines of a still-open fence, spilled to a temporary file beyond ``limit`` characters.
+
+    A fence that is never closed is not a block, so when streaming, its
+    lines must not pile up in memory until the end of the file. Iterating
+    gives the lines back, for joining into the block; close() discards them.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lines = []
+        self.size = 0
+        self._file = None
+
+    def append(self, line: str):
+        if self._file is not None:
+            self._file.write(line + '\n')
+            return
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size > self.limit:
+            self._file = tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n')
+            self._file.writelines(line + '\n' for line in self.lines)
+            self.lines = []
+
+    def __iter__(self) -> Iterator[str]:
+        if self._file is None:
+            yield from self.lines
+            return
+        self._file.seek(0)
+        for line in self._file:
+            yield line[:-1]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.lines = []
+
+
+class LineIndex:
+    """Sorted table of line start offsets for mapping offsets to line numbers."""
+
+    def __init__(self, content: str):
+        self.line_starts = [0]
+        self.line_starts.extend(match.end() for match in NEWLINE_PATTERN.finditer(content))
+
+    def __len__(self) -> int:
+        return len(self.line_starts)
+
+    def line_of(self, offset: int, lo: int = 0) -> int:
+        """Return the 0-based line number containing ``offset``.
+
+        ``lo`` is a line known to be at or before the answer, which narrows
+        the search when offsets are looked up in increasing order.
+        """
+        return bisect_right(self.line_starts, offset, lo) - 1
+
+    def offset_of(self, line: int) -> int:
+        """Return the offset at which the 0-based ``line`` starts."""
+        return self.line_starts[line]
+
+
+def may_contain_code(data) -> bool:
+    """Cheap check of raw bytes (or an mmap) for anything that could start a code block.
+
+    Fenced blocks need a ``` and indented blocks a line starting with four
+    spaces or a tab, so data without either has no code blocks at all.
+    """
+    if data.find(b'```') != -1:
+        return True
+    for indent in (b'\t', b'    '):
+        # Most data without code fails the first, fastest search
+        if data.find(indent) != -1 and (data[:len(indent)] == indent or
+                                        data.find(b'\n' + indent) != -1 or
+                                        data.find(b'\r' + indent) != -1):
+            return True
+    return False
+
+
+class FenceIndex:
+    """Line ranges of fenced blocks, added in file order, for overlap lookups."""
+
+    def __init__(self, fenced_blocks: Iterable[CodeBlock] = ()):
+        self.starts = []
+        self.ends = []
+        for block in fenced_blocks:
+            self.add(block)
+
+    def add(self, block: CodeBlock):
+        self.starts.append(block.start_line)
+        self.ends.append(block.end_line)
+
+    def overlaps(self, block: CodeBlock) -> bool:
+        """Check whether any fenced block shares a line with ``block``."""
+        # Fences never overlap each other, so only the last one starting
+        # at or before the block's end can reach into it
+        i = bisect_right(self.starts, block.end_line) - 1
+        return i >= 0 and self.ends[i] >= block.start_line
+
+
+def iter_text_lines(f, digest=None, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the lines of a binary UTF-8 file, reading it in fixed-size chunks.
+
+    Lines are the same as those of ``content.split('\\n')`` on the whole
+    file after universal newline translation; only the current chunk and
+    an incomplete line are held in memory. Every chunk read is also fed to
+    ``digest``, if given.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = []
+    held_cr = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if digest is not None and chunk:
+            digest.update(chunk)
+        text = held_cr + decoder.decode(chunk, final=not chunk)
+        held_cr = ''
+        if '\r' in text:
+            if chunk and text.endswith('\r'):
+                # May be the first half of a \r\n split across chunks
+                text, held_cr = text[:-1], '\r'
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = text.split('\n')
+        if len(lines) > 1:
+            pending.append(lines[0])
+            lines[0] = ''.join(pending)
+            pending = [lines.pop()]
+            yield from lines
+        elif text:
+            pending.append(text)
+        if not chunk:
+            break
+    yield ''.join(pending)
+
+
+class LineScanner:
+    """Single-pass, line-oriented scanner for fenced blocks, indented blocks and titles.
+
+    Fenced and indented blocks are tracked independently on every line, so
+    the results match running the individual extractors one after another
+    while touching each line of the input exactly once.
+    """
+
+    def __init__(self, extractor: 'CodeExtractor', spill_size: Optional[int] = None):
+        self.extractor = extractor
+        # With a spill size, open fences beyond it are kept on disk, for streamed input
+        self.spill_size = spill_size
+        self.titles = [None] * len(TITLE_PATTERNS)
+        # Start of the fence open when the last block was yielded
+        self.fence_start = None
+
+    @property
+    def title(self) -> Optional[str]:
+        """Highest-priority title seen so far, if any."""
+        for title in self.titles:
+            if title is not None:
+                return title
+        return None
+
+    def scan(self, lines: Iterable[str], source: Optional[str] = None) -> Iterator[Tuple[str, CodeBlock]]:
+        """Yield ``('fenced', block)`` and ``('indented', block)`` pairs as blocks close.
+
+        ``source`` is the text ``lines`` were split from on newlines, if any;
+        blocks then refer to it instead of copying their content.
+        """
+        titles = self.titles
+        fence_start = None
+        fence_language = None
+        fence_lines = []
+        fence_offset = 0
+        new_fence_lines = list if self.spill_size is None else partial(SpilledLines, self.spill_size)
+        indented_lines = []
+        indented_start = 0
+        indented_offset = 0
+        # Offset of the current line in source
+        offset = 0
+
+        for line_no, line in enumerate(lines):
+            # Titles
+            if titles[0] is None and line.startswith(TITLE_PREFIXES):
+                for slot, pattern in enumerate(TITLE_PATTERNS):
+                    if titles[slot] is None:
+                        match = pattern.match(line)
+                        if match:
+                            titles[slot] = match.group(1)
+
+            # Fenced blocks
+            if fence_start is None:
+                if '```' in line:
+                    match = FENCE_OPEN_PATTERN.search(line)
+                    if match:
+                        fence_start = line_no
+                        fence_language = match.group(1)
+                        fence_lines = new_fence_lines()
+                        fence_offset = offset + len(line) + 1
+            elif line.startswith('```') and line_no > fence_start + 1:
+                # The line right after an opening fence is always content
+                block = self.extractor._make_fenced_block('\n'.join(fence_lines), fence_language,
+                                                          fence_start, line_no, source, fence_offset)
+                if self.spill_size is not None:
+                    fence_lines.close()
+                fence_start = None
+                # The rest of a closing line can open the next fence, as in "``````python"
+                match = FENCE_OPEN_PATTERN.search(line, 3)
+                if match:
+                    fence_start = line_no
+                    fence_language = match.group(1)
+                    fence_lines = new_fence_lines()
+                    fence_offset = offset + len(line) + 1
+                if block:
+                    self.fence_start = fence_start
+                    yield 'fenced', block
+            else:
+                fence_lines.append(line)
+
+            # Indented blocks
+            if line.startswith(('    ', '\t')) or (indented_lines and not line.strip()):
+                if not indented_lines:
+                    indented_start = line_no
+                    indented_offset = offset
+                indented_lines.append(line)
+            elif indented_lines:
+                block = self.extractor._make_indented_block(indented_lines, indented_start, source,
+                                                            indented_offset)
+                if block:
+                    self.fence_start = fence_start
+                    yield 'indented', block
+                indented_lines = []
+            offset += len(line) + 1
+
+        # Handle last block (an unterminated fence is not a code block)
+        if fence_start is not None and self.spill_size is not None:
+            fence_lines.close()
+        if indented_lines:
+            block = self.extractor._make_indented_block(indented_lines, indented_start, source,
+                                                        indented_offset)
+            if block:
+                self.fence_start = None
+                yield 'indented', block
+
+
+class Manifest:
+    """Record of processed source files, kept as JSON lines under the output directory.
+
+    Each line stores a source's absolute path, size, mtime and content
+    hash; later lines supersede earlier ones for the same path. Updates
+    are only written by close(), which the extractor calls once the
+    sources' output is written, so a crash cannot leave a source marked
+    as done without its output.
+    """
+
+    FILENAME = '.manifest.jsonl'
+
+    def __init__(self, output_dir: Path, fsync: bool = False):
+        self.path = Path(output_dir) / self.FILENAME
+        self.fsync = fsync
+        self.entries = {}
+        # Records not yet written
+        self._unwritten = []
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    self.entries[record['path']] = record
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        self._superseded = lines - len(self.entries)
+
+    def get(self, file_path: str) -> Optional[Dict]:
+        """Return the recorded entry for a source file, if any."""
+        return self.entries.get(os.path.abspath(file_path))
+
+    def is_unchanged(self, file_path: str) -> Tuple[bool, Optional[str]]:
+        """Check a file's size and mtime against the manifest.
+
+        Returns whether the file is unchanged and, when only the size and
+        mtime could not confirm it, the recorded content hash to compare.
+        """
+        record = self.get(file_path)
+        if record is None:
+            return False, None
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False, None
+        if st.st_size == record['size'] and st.st_mtime_ns == record['mtime_ns']:
+            return True, None
+        return False, record['hash']
+
+    def update(self, file_path: str, source: Dict):
+        """Record that a source file has been processed."""
+        record = dict(source, path=os.path.abspath(file_path))
+        if record['path'] in self.entries:
+            self._superseded += 1
+        self.entries[record['path']] = record
+        self._unwritten.append(record)
+
+    def close(self):
+        """Write the records of updates, rewriting the manifest when most of its lines are superseded."""
+        if self._unwritten:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(record) + '\n' for record in self._unwritten)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._unwritten = []
+        if self._superseded > len(self.entries):
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in self.entries.values():
+                    f.write(json.dumps(record) + '\n')
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            if self.fsync:
+                _fsync_directory(self.path.parent)
+            self._superseded = 0
+
+
+class BlockStore:
+    """Content-addressed store writing each distinct code block once.
+
+    Blocks are saved as ``blocks/<first two hex digits>/<digest><ext>``
+    under the output directory. ``blocks/index.jsonl`` records, one JSON
+    line each, which source files and topics every block was found in;
+    like the manifest, records are only written by close(), after the
+    blocks themselves.
+    """
+
+    DIRECTORY = 'blocks'
+    INDEX = 'index.jsonl'
+
+    def __init__(self, output_dir: Path, writer: 'BlockWriter', fsync: bool = False):
+        self.root = Path(output_dir) / self.DIRECTORY
+        self.index_path = self.root / self.INDEX
+        self.writer = writer
+        self.fsync = fsync
+        self.sources = {}
+        # Where blocks saved by this run went, which for archives is not a file
+        self._locations = {}
+        # Index records not yet written
+        self._unwritten = []
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    self.sources.setdefault(record['hash'], set()).add(record['source'])
+        except FileNotFoundError:
+            pass
+
+    def path_of(self, code_block: CodeBlock) -> Path:
+        return self.root / code_block.digest[:2] / (code_block.digest + code_block.get_file_extension())
+
+    def save(self, code_block: CodeBlock) -> Dict:
+        """Save a code block unless an identical one is already stored; return its location."""
+        path = self.path_of(code_block)
+        location = self._locations.get(path)
+        if location is None:
+            if code_block.digest in self.sources and path.exists():
+                location = {'path': str(path)}
+            else:
+                location = self.writer.write(path, code_block.content)
+            self._locations[path] = location
+        return location
+
+    def add_source(self, code_block: CodeBlock, file_path: str, topic: str):
+        """Record in the index that a source file contains a code block."""
+        source = os.path.abspath(file_path)
+        sources = self.sources.setdefault(code_block.digest, set())
+        if source in sources:
+            return
+        sources.add(source)
+        self._unwritten.append({'hash': code_block.digest, 'path': str(self.path_of(code_block)),
+                                'source': source, 'topic': topic})
+
+    def close(self):
+        """Write the index records added since the last close()."""
+        if self._unwritten:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(record) + '\n' for record in self._unwritten)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._unwritten = []
+
+
+def format_location(location: Dict) -> str:
+    """Format a written file's location as ``path``, or ``archive:member`` inside an archive."""
+    if 'member' in location:
+        return f"{location['path']}:{location['member']}"
+    return location['path']
+
+
+# When output is forced to disk: never, at flush points, or for every file
+FSYNC_POLICIES = ('none', 'batch', 'always')
+
+
+def _fsync_path(path: Path):
+    """Force a file's or directory's contents to disk, where the OS allows it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Directories cannot be opened on Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(directory: Path):
+    """Make a directory's entries, such as files renamed into it, durable."""
+    _fsync_path(directory)
+
+
+def _write_file(path: Path, data: Union[str, bytes], fsync: bool = False):
+    """Write text (as UTF-8) or bytes to a file atomically.
+
+    The data goes to a hidden temporary file next to ``path`` that is then
+    renamed over it, so a crash never leaves a partial file under the real
+    name. With ``fsync`` the data and the rename are forced to disk.
+    """
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        if isinstance(data, str):
+            f = open(temp_path, 'w', encoding='utf-8')
+        else:
+            f = open(temp_path, 'wb')
+        with f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    if fsync:
+        _fsync_directory(path.parent)
+
+
+def _write_after(dependencies: List[Future], path: Path, data: Union[str, bytes], fsync: bool = False):
+    """Write a file once the writes it depends on have succeeded, raising their first error."""
+    for future in dependencies:
+        future.result()
+    _write_file(path, data, fsync)
+
+
+class BlockWriter:
+    """Writes output files atomically through a bounded pool of threads.
+
+    Each directory is created once, before the first file is written into
+    it. With ``threads`` set to 0 files are written synchronously. Errors
+    from background writes are raised by the next flush(). ``fsync`` is
+    one of FSYNC_POLICIES; with 'batch', files written since the last
+    flush are forced to disk by flush(), which also runs every
+    BATCH_SIZE files.
+    """
+
+    BATCH_SIZE = 1024
+
+    def __init__(self, threads: int = 4, fsync: str = 'none'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.fsync = fsync
+        self._created_dirs = set()
+        self._executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        self._pending = deque()
+        # The latest pending write of each path, so writes to one path stay in order
+        self._writing = {}
+        self._unsynced = []
+        # Bounds the memory held by contents waiting to be written
+        self._max_pending = threads * 16
+
+    def ensure_dir(self, directory: Path):
+        """Create a directory, unless this writer already did."""
+        if directory not in self._created_dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._created_dirs.add(directory)
+
+    def write(self, path: Path, data: Union[str, bytes], after: Iterable[Path] = ()) -> Dict:
+        """Write text or bytes to ``path``, creating its directory if needed.
+
+        The file is only written once the pending writes of the paths in
+        ``after`` have succeeded, as metadata must not appear before the
+        files it lists. Returns the file's location, as recorded in
+        metadata.json.
+        """
+        self.ensure_dir(path.parent)
+        fsync = self.fsync == 'always'
+        if self._executor is None:
+            _write_file(path, data, fsync)
+        else:
+            previous = self._writing.get(path)
+            if previous is not None:
+                previous.result()
+            # Submitted earlier, so they are running or ahead in the queue and cannot deadlock this write
+            dependencies = [self._writing[other] for other in after if other in self._writing]
+            if dependencies:
+                future = self._executor.submit(_write_after, dependencies, path, data, fsync)
+            else:
+                future = self._executor.submit(_write_file, path, data, fsync)
+            self._writing[path] = future
+            pending = self._pending
+            pending.append((path, future))
+            while pending and (pending[0][1].done() or len(pending) > self._max_pending):
+                self._finish(*pending.popleft())
+        if self.fsync == 'batch':
+            self._unsynced.append(path)
+            if len(self._unsynced) >= self.BATCH_SIZE:
+                self.flush()
+        return {'path': str(path)}
+
+    def _finish(self, path: Path, future: Future):
+        if self._writing.get(path) is future:
+            del self._writing[path]
+        future.result()
+
+    def write_archive(self, path: Path, members: List[Tuple[str, str]]) -> Dict:
+        """Write ``(name, content)`` pairs as a single uncompressed tar file."""
+        buffer = io.BytesIO()
+        mtime = time.time()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for name, content in members:
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = mtime
+                tar.addfile(info, io.BytesIO(data))
+        return self.write(path, buffer.getvalue())
+
+    def flush(self):
+        """Wait for all pending writes, raising the first error, and sync them under 'batch'."""
+        while self._pending:
+            self._finish(*self._pending.popleft())
+        if self._unsynced:
+            paths = list(dict.fromkeys(self._unsynced))
+            self._unsynced = []
+            directories = list(dict.fromkeys(path.parent for path in paths))
+            run = self._executor.map if self._executor is not None else map
+            # Data first, then the renames that made it visible
+            list(run(_fsync_path, paths))
+            list(run(_fsync_directory, directories))
+
+    def close(self):
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class ArchiveWriter:
+    """Writes every output file of a run into one tar or zip archive in the output directory.
+
+    Members are named by their path relative to the output directory, so
+    unpacking the archive there gives the same tree as the 'dir' format.
+    The archive is opened on the first write and completed by flush() or
+    close(); writes after a flush go into a new archive, so each queue
+    batch is complete on disk before its sources are moved on.
+    """
+
+    FORMATS = ('tar', 'zip')
+
+    def __init__(self, output_dir: Path, archive_format: str, fsync: str = 'none'):
+        if archive_format not in self.FORMATS:
+            raise ValueError(f"unknown archive format: {archive_format}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.output_dir = Path(output_dir)
+        self.format = archive_format
+        self.fsync = fsync
+        self.path = None
+        self._temp_path = None
+        self._archive = None
+
+    def _open(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = 'extracted_' + time.strftime('%Y%m%d-%H%M%S')
+        path = self.output_dir / f"{stem}.{self.format}"
+        suffix = 1
+        while path.exists():
+            path = self.output_dir / f"{stem}.{suffix}.{self.format}"
+            suffix += 1
+        self.path = path
+        # Written under a .part name and renamed into place once complete
+        self._temp_path = path.with_name(path.name + '.part')
+        if self.format == 'zip':
+            self._archive = zipfile.ZipFile(self._temp_path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(self._temp_path, 'w')
+
+    def write(self, path: Path, data: Union[str, bytes], after: Iterable[Path] = ()) -> Dict:
+        """Add text or bytes to the archive under ``path``; return its location.
+
+        Members are added in order, so ``after`` needs no waiting.
+        """
+        if self._archive is None:
+            self._open()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        name = Path(os.path.relpath(path, self.output_dir)).as_posix()
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with warnings.catch_warnings():
+                # A topic seen again replaces its files, as in the 'dir' format
+                warnings.simplefilter('ignore', UserWarning)
+                self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._archive.addfile(info, io.BytesIO(data))
+        return {'path': str(self.path), 'member': name}
+
+    def flush(self):
+        """Complete the archive and move it to its final name."""
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+            if self.fsync != 'none':
+                _fsync_path(self._temp_path)
+            os.replace(self._temp_path, self.path)
+            if self.fsync != 'none':
+                _fsync_directory(self.output_dir)
+
+    def close(self):
+        self.flush()
+
+
+class JsonlSink:
+    """Writes a JSON line for every saved code block, to a file or stdout."""
+
+    # Whether add_source() and clear_source() use the source's content hash
+    needs_source_hash = False
+
+    def __init__(self, destination: str):
+        self.destination = destination
+        if destination == '-':
+            self._file = sys.stdout
+        else:
+            self._file = open(destination, 'a', encoding='utf-8')
+
+    def add_source(self, file_path: str, topic: str, source: Dict):
+        pass
+
+    def clear_source(self, file_path: str, source: Dict):
+        pass
+
+    def add_block(self, file_path: str, topic: str, code_block: CodeBlock, content: str):
+        record = {
+            'source': str(file_path),
+            'topic': topic,
+            'language': code_block.language,
+            'start_line': code_block.start_line,
+            'hash': code_block.hash,
+            # The full digest identifies the content; hash only names its file
+            'digest': code_block.digest,
+            'content': content
         }
-        return extensions.get(self.language, '.txt')
+        self._file.write(json.dumps(record) + '\n')
+
+    def end_source(self, file_path: str):
+        # Consumers see each source's records as soon as it is saved
+        self._file.flush()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+class SqliteSink:
+    """Stores sources and code blocks in a SQLite database.
+
+    Blocks are indexed by hash (the full content digest, not the short
+    hash in file names), language and topic. Rows are inserted in
+    transactions of ``transaction_size`` blocks; processing a source again
+    replaces its blocks, or deletes them once it has none.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            topic TEXT NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            hash TEXT,
+            processed_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS blocks (
+            id INTEGER PRIMARY KEY,
+            source_id INTEGER NOT NULL REFERENCES sources(id),
+            topic TEXT NOT NULL,
+            language TEXT NOT NULL,
+            confidence REAL,
+            start_line INTEGER,
+            end_line INTEGER,
+            hash TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS blocks_hash ON blocks(hash);
+        CREATE INDEX IF NOT EXISTS blocks_language ON blocks(language);
+        CREATE INDEX IF NOT EXISTS blocks_topic ON blocks(topic);
+        CREATE INDEX IF NOT EXISTS blocks_source ON blocks(source_id);
+    """
+
+    # Stored in sources.hash
+    needs_source_hash = True
+
+    def __init__(self, database: str, transaction_size: int = 10000):
+        self.database = database
+        self.transaction_size = transaction_size
+        self._connection = sqlite3.connect(database)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+        self._source_id = None
+        self._rows = []
+        self._uncommitted = 0
+
+    def add_source(self, file_path: str, topic: str, source: Dict):
+        path = os.path.abspath(file_path)
+        values = (topic, source.get('size'), source.get('mtime_ns'), source.get('hash'),
+                  time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+        cursor = self._connection.cursor()
+        row = cursor.execute('SELECT id FROM sources WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            cursor.execute('INSERT INTO sources (topic, size, mtime_ns, hash, processed_at, path) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', values + (path,))
+            self._source_id = cursor.lastrowid
+        else:
+            self._source_id = row[0]
+            cursor.execute('UPDATE sources SET topic = ?, size = ?, mtime_ns = ?, hash = ?, '
+                           'processed_at = ? WHERE id = ?', values + (self._source_id,))
+            cursor.execute('DELETE FROM blocks WHERE source_id = ?', (self._source_id,))
+
+    def clear_source(self, file_path: str, source: Dict):
+        """Record that a source no longer contains code blocks, deleting any it had."""
+        path = os.path.abspath(file_path)
+        cursor = self._connection.cursor()
+        row = cursor.execute('SELECT id FROM sources WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return
+        cursor.execute('UPDATE sources SET size = ?, mtime_ns = ?, hash = ?, processed_at = ? WHERE id = ?',
+                       (source.get('size'), source.get('mtime_ns'), source.get('hash'),
+                        time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()), row[0]))
+        cursor.execute('DELETE FROM blocks WHERE source_id = ?', (row[0],))
+        self._uncommitted += 1
+
+    def add_block(self, file_path: str, topic: str, code_block: CodeBlock, content: str):
+        self._rows.append((self._source_id, topic, code_block.language, code_block.confidence,
+                           code_block.start_line, code_block.end_line, code_block.digest, content))
+
+    def end_source(self, file_path: str):
+        self._connection.executemany(
+            'INSERT INTO blocks (source_id, topic, language, confidence, start_line, end_line, hash, content) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._rows)
+        self._uncommitted += len(self._rows) + 1
+        self._rows = []
+        if self._uncommitted >= self.transaction_size:
+            self.flush()
+
+    def flush(self):
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+
+class StageTimer:
+    """Cumulative wall-clock time, CPU time and call counts per pipeline stage.
+
+    Stages may nest: time spent in an inner stage is counted there and not
+    in the enclosing one, so the stages add up to the total. CPU time is
+    that of the calling thread.
+    """
+
+    # Stages in pipeline order, for reports
+    STAGES = ('read', 'scan', 'detect', 'dedup', 'topic', 'write', 'metadata')
+
+    def __init__(self):
+        # name -> [calls, wall seconds, cpu seconds]
+        self.stages: Dict[str, List] = {}
+        # [wall start, cpu start, wall in inner stages, cpu in inner stages] per open stage
+        self._open: List[List[float]] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the body of a ``with`` statement as one call of stage ``name``."""
+        frame = [time.perf_counter(), time.thread_time(), 0.0, 0.0]
+        self._open.append(frame)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - frame[0]
+            cpu = time.thread_time() - frame[1]
+            self._open.pop()
+            if self._open:
+                self._open[-1][2] += wall
+                self._open[-1][3] += cpu
+            self.add(name, wall - frame[2], cpu - frame[3])
+
+    def add(self, name: str, wall: float, cpu: float, calls: int = 1):
+        """Record ``calls`` calls of a stage taking ``wall`` and ``cpu`` seconds in all."""
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = [0, 0.0, 0.0]
+        entry[0] += calls
+        entry[1] += wall
+        entry[2] += cpu
+
+    def merge(self, stages: Dict[str, Dict]):
+        """Add the stages of another timer's snapshot(), e.g. from a worker process."""
+        for name, stage in stages.items():
+            self.add(name, stage['wall'], stage['cpu'], stage['calls'])
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Return ``{stage: {'calls', 'wall', 'cpu'}}``, with times in seconds, in pipeline order."""
+        order = {name: i for i, name in enumerate(self.STAGES)}
+        names = sorted(self.stages, key=lambda name: (order.get(name, len(order)), name))
+        return {name: dict(zip(('calls', 'wall', 'cpu'), self.stages[name])) for name in names}
+
+    def since(self, snapshot: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Return the stages called since ``snapshot`` was taken, in the same form."""
+        stages = {}
+        for name, stage in self.snapshot().items():
+            before = snapshot.get(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            if stage['calls'] > before['calls']:
+                stages[name] = {key: stage[key] - before[key] for key in stage}
+        return stages
+
+
+class Metrics:
+    """Counters and stage latency histograms in the Prometheus text format.
+
+    Every file saved by a CodeExtractor is observe()d. The metrics can be
+    served over HTTP at ``/metrics`` on ``port``, and written to
+    ``textfile`` (for node_exporter's textfile collector) at most every
+    ``interval`` seconds, on flush() and on close(). Rates such as files
+    per second are left to the scraper.
+    """
+
+    # Upper bounds, in seconds, of the buckets of the per-file stage latency histograms
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    OUTCOMES = ('extracted', 'no_code', 'unchanged', 'failed')
+
+    def __init__(self, port: Optional[int] = None, textfile: Optional[str] = None,
+                 host: str = '127.0.0.1', interval: float = 1.0):
+        self.textfile = Path(textfile) if textfile else None
+        self.interval = interval
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+        self.files = dict.fromkeys(self.OUTCOMES, 0)
+        self.bytes_read = 0
+        self.blocks: Dict[str, int] = {}
+        # stage -> [bucket counts, sum of seconds, count], and stage -> CPU seconds
+        self.latency: Dict[str, List] = {}
+        self.cpu: Dict[str, float] = {}
+        self.server = None
+        if port is not None:
+            metrics = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def address(self) -> Optional[Tuple[str, int]]:
+        """The ``(host, port)`` metrics are served on, if any."""
+        return self.server.server_address[:2] if self.server is not None else None
+
+    def observe(self, extraction: Dict, stages: Dict[str, Dict]):
+        """Count a saved extract_file result, and the time each stage took on it."""
+        if 'error' in extraction:
+            outcome = 'failed'
+        elif extraction.get('unchanged'):
+            outcome = 'unchanged'
+        elif 'code_blocks' in extraction:
+            outcome = 'extracted'
+        else:
+            outcome = 'no_code'
+        with self._lock:
+            self.files[outcome] += 1
+            self.bytes_read += extraction.get('source', {}).get('size', 0)
+            for code_block in extraction.get('code_blocks', ()):
+                self.blocks[code_block.language] = self.blocks.get(code_block.language, 0) + 1
+            for name, stage in stages.items():
+                histogram = self.latency.get(name)
+                if histogram is None:
+                    histogram = self.latency[name] = [[0] * len(self.BUCKETS), 0.0, 0]
+                index = bisect_left(self.BUCKETS, stage['wall'])
+                if index < len(self.BUCKETS):
+                    histogram[0][index] += 1
+                histogram[1] += stage['wall']
+                histogram[2] += 1
+                self.cpu[name] = self.cpu.get(name, 0.0) + stage['cpu']
+        if self.textfile is not None and time.monotonic() - self._last_write >= self.interval:
+            self.write_textfile()
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        def label(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Iterable[Tuple[str, str, float]]):
+            lines.append(f"# HELP code_extractor_{name} {help_text}")
+            lines.append(f"# TYPE code_extractor_{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"code_extractor_{name}{suffix}{{{labels}}} {value}" if labels
+                             else f"code_extractor_{name}{suffix} {value}")
+
+        with self._lock:
+            metric('files_total', 'counter', 'Files handled, by outcome.',
+                   [('', f'outcome="{outcome}"', count) for outcome, count in self.files.items()])
+            metric('bytes_read_total', 'counter', 'Bytes of input read.', [('', '', self.bytes_read)])
+            metric('code_blocks_total', 'counter', 'Code blocks extracted, by language.',
+                   [('', f'language="{label(language)}"', count)
+                    for language, count in sorted(self.blocks.items())])
+            samples = []
+            for name, (buckets, total, count) in self.latency.items():
+                cumulative = 0
+                for bound, bucket in zip(self.BUCKETS, buckets):
+                    cumulative += bucket
+                    samples.append(('_bucket', f'stage="{name}",le="{bound}"', cumulative))
+                samples.append(('_bucket', f'stage="{name}",le="+Inf"', count))
+                samples.append(('_sum', f'stage="{name}"', total))
+                samples.append(('_count', f'stage="{name}"', count))
+            metric('stage_seconds', 'histogram', 'Wall-clock time each stage took per file.', samples)
+            metric('stage_cpu_seconds_total', 'counter', 'CPU time spent in each stage.',
+                   [('', f'stage="{name}"', seconds) for name, seconds in self.cpu.items()])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self):
+        """Replace the textfile with the current metrics."""
+        self._last_write = time.monotonic()
+        _write_file(self.textfile, self.render())
+
+    def flush(self):
+        if self.textfile is not None:
+            self.write_textfile()
+
+    def close(self):
+        self.flush()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
 
 
 class CodeExtractor:
     """Main class for extracting code blocks from files."""
     
-    def __init__(self, output_dir: str = "extracted_code"):
-        self.output_dir = Path(output_dir)
+    # Blocks below the config's coalesce_block_size go into this per-topic archive
+    SMALL_BLOCKS_ARCHIVE = 'small_blocks.tar'
+
+    def __init__(self, output_dir: Optional[str] = None, config: Optional[ExtractorConfig] = None,
+                 incremental: bool = False, content_addressed: bool = False, write_threads: int = 4,
+                 output_format: str = 'dir', sinks: Iterable = (), fsync: str = 'none',
+                 metrics: Optional[Metrics] = None):
+        self.config = config or load_config()
+        self.output_dir = Path(output_dir or self.config.output_directory)
+        self.output_format = output_format
+        # Extra outputs, such as JsonlSink or SqliteSink, that are given every saved block,
+        # and told of sources found to have none
+        self.sinks = list(sinks)
+        if output_format == 'dir':
+            self.writer = BlockWriter(write_threads, fsync)
+        else:
+            self.writer = ArchiveWriter(self.output_dir, output_format, fsync)
+        # With a manifest, sources unchanged since the last run are skipped
+        self.manifest = Manifest(self.output_dir, fsync != 'none') if incremental else None
+        # With a block store, identical blocks from any source are written once
+        self.block_store = BlockStore(self.output_dir, self.writer, fsync != 'none') if content_addressed else None
+        # Sources are only hashed when something records the hash
+        self.need_source_hash = incremental or any(sink.needs_source_hash for sink in self.sinks)
+        self._executor = None
+        self._executor_jobs = 0
+        # Time spent per stage, reported by get_stats()
+        self.timer = StageTimer()
+        # Optional Metrics, given every saved extraction with the time its stages took
+        self.metrics = metrics
         self.stats = {
             'files_processed': 0,
+            'files_unchanged': 0,
             'code_blocks_found': 0,
             'languages_detected': set(),
             'topics_created': set()
         }
     
-    def extract_markdown_code_blocks(self, content: str) -> List[CodeBlock]:
-        """Extract code blocks from markdown format."""
+    def extract_markdown_code_blocks(self, content: str, line_index: Optional[LineIndex] = None) -> List[CodeBlock]:
+        """Extract code blocks from markdown format.
+
+        ``line_index`` may be passed in when the caller already built one
+        for ``content``, so several extractors can share it.
+        """
         code_blocks = []
+        if line_index is None:
+            line_index = LineIndex(content)
+        start_line = 0
         
-        # Pattern for fenced code blocks with optional language
-        pattern = r'```(\w+)?\n(.*?)\n```'
-        matches = re.finditer(pattern, content, re.DOTALL)
-        
-        for match in matches:
+        # Fenced code blocks with optional language
+        for match in FENCED_BLOCK_PATTERN.finditer(content):
             language = match.group(1)
             code_content = match.group(2)
-            start_line = content[:match.start()].count('\n')
+            # Matches come in increasing order, so resume the search from the last line
+            start_line = line_index.line_of(match.start(), start_line)
             
             # Only add non-empty blocks with substantial content
-            if code_content.strip() and len(code_content.strip()) > 20:
-                code_blocks.append(CodeBlock(code_content, language, start_line))
+            end_line = line_index.line_of(match.end() - 1, start_line)
+            block = self._make_fenced_block(code_content, language, start_line, end_line,
+                                            content, match.start(2))
+            if block:
+                code_blocks.append(block)
         
         return code_blocks
     
@@ -113,163 +1417,381 @@ class CodeExtractor:
         
         for i, line in enumerate(lines):
             # Check if line is indented with 4+ spaces or starts with tab
-            if re.match(r'^(    |\t)', line) or (line.strip() == '' and current_block):
+            if line.startswith(('    ', '\t')) or (line.strip() == '' and current_block):
                 if not current_block:
                     current_start = i
                 current_block.append(line)
             else:
-                if current_block and any(line.strip() for line in current_block):
-                    # Remove common indentation
-                    block_content = '\n'.join(current_block).strip()
-                    # Only add blocks that are substantial (more than 3 lines and 50 characters)
-                    if block_content and len(current_block) > 3 and len(block_content) > 50:
-                        # Check if it looks like actual code (has some programming patterns)
-                        if self._looks_like_code(block_content):
-                            code_blocks.append(CodeBlock(block_content, None, current_start))
+                if current_block:
+                    block = self._make_indented_block(current_block, current_start)
+                    if block:
+                        code_blocks.append(block)
                 current_block = []
         
         # Handle last block
-        if current_block and any(line.strip() for line in current_block):
-            block_content = '\n'.join(current_block).strip()
-            if block_content and len(current_block) > 3 and len(block_content) > 50:
-                if self._looks_like_code(block_content):
-                    code_blocks.append(CodeBlock(block_content, None, current_start))
+        if current_block:
+            block = self._make_indented_block(current_block, current_start)
+            if block:
+                code_blocks.append(block)
         
         return code_blocks
     
     def _looks_like_code(self, content: str) -> bool:
         """Check if content looks like actual code."""
-        # Look for programming patterns
-        code_patterns = [
-            r'[a-zA-Z_]\w*\s*\(',  # Function calls
-            r'[a-zA-Z_]\w*\s*=',   # Variable assignments
-            r'\{[^}]*\}',          # Braces
-            r'["\'][^"\']*["\']',  # Quoted strings
-            r'//.*|/\*.*\*/|#.*',  # Comments
-            r'\w+\.\w+',           # Method calls
-            r'if\s*\(|while\s*\(|for\s*\(',  # Control structures
-            r'</?\w+[^>]*>',       # HTML tags
-            r'[a-zA-Z-]+:\s*[^;]+;',  # CSS properties
-        ]
-        
         matches = 0
-        for pattern in code_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
+        for pattern in CODE_PATTERNS:
+            if pattern.search(content):
                 matches += 1
-        
-        # Consider it code if it has at least 2 programming patterns
-        return matches >= 2
+                # Consider it code if it has at least 2 programming patterns
+                if matches >= 2:
+                    return True
+        return False
     
+    def _make_fenced_block(self, code_content: str, language: Optional[str], start_line: int,
+                           end_line: int, source: Optional[str] = None, offset: int = 0) -> Optional[CodeBlock]:
+        """Build a fenced code block from its content, if substantial enough.
+
+        ``source`` and ``offset`` locate the content in the scanned text, if any.
+        """
+        stripped = code_content.strip()
+        if stripped and len(stripped) > self.config.minimum_code_block_size:
+            language, confidence = (language, None) if language else self._classify_language(stripped)
+            return CodeBlock(code_content, language, start_line, self.config, end_line, confidence,
+                             source, offset)
+        return None
+
+    def _make_indented_block(self, lines: List[str], start_line: int, source: Optional[str] = None,
+                             offset: int = 0) -> Optional[CodeBlock]:
+        """Build an indented code block from its lines, if it looks like real code."""
+        block_text = '\n'.join(lines)
+        block_content = block_text.strip()
+        # Only add blocks that are substantial (more lines and characters than the minimums)
+        if (block_content and len(lines) > self.config.minimum_indented_block_lines and
+                len(block_content) > self.config.minimum_indented_block_size):
+            # Check if it looks like actual code (has some programming patterns)
+            if self._looks_like_code(block_content):
+                language, confidence = self._classify_language(block_content)
+                return CodeBlock(block_text, language, start_line, self.config,
+                                 start_line + len(lines) - 1, confidence, source, offset)
+        return None
+
+    def _classify_language(self, content: str) -> Tuple[str, float]:
+        """Detect the language of a block's stripped content, timed as the 'detect' stage."""
+        with self.timer.stage('detect'):
+            return self.config.detector.classify(content)
+
+    def _merge_blocks(self, fenced_blocks: List[CodeBlock], indented_blocks: List[CodeBlock]) -> List[CodeBlock]:
+        """Combine fenced and indented blocks, dropping indented blocks that overlap a fence."""
+        fences = FenceIndex(fenced_blocks)
+        code_blocks = list(fenced_blocks)
+        code_blocks.extend(block for block in indented_blocks if not fences.overlaps(block))
+        return code_blocks
+
+    def _iter_merged(self, scanner: LineScanner, lines: Iterable[str]) -> Iterator[CodeBlock]:
+        """Yield the blocks _merge_blocks would keep, as soon as each is settled.
+
+        Fenced blocks are yielded as they close. An indented block that
+        overlaps a fence still open is held back until that fence closes,
+        since an unterminated fence is not a block and does not hide it.
+        """
+        fences = FenceIndex()
+        pending = []
+        for kind, block in scanner.scan(lines):
+            if kind == 'fenced':
+                fences.add(block)
+                yield block
+            else:
+                pending.append(block)
+            if pending and (scanner.fence_start is None or scanner.fence_start > pending[-1].end_line):
+                for block in pending:
+                    if not fences.overlaps(block):
+                        yield block
+                pending = []
+        for block in pending:
+            if not fences.overlaps(block):
+                yield block
+
+    def iter_blocks(self, file_path: str) -> Iterator[CodeBlock]:
+        """Yield the code blocks of a file lazily, as soon as each is recognised.
+
+        The file is read in chunks, so consumers can start on the first
+        blocks while the rest is still being parsed. Blocks come in the
+        order they end in the file, with fenced and indented blocks
+        interleaved; otherwise they are the blocks extract_code_blocks
+        returns. Errors reading or decoding the file are raised.
+        """
+        with open(file_path, 'rb') as f:
+            yield from self._iter_merged(LineScanner(self, FENCE_SPILL_SIZE), iter_text_lines(f))
+
+    def iter_files(self, file_paths: Iterable[str]) -> Iterator[Tuple[str, CodeBlock]]:
+        """Yield ``(file_path, block)`` pairs for the code blocks of each file in turn."""
+        for file_path in file_paths:
+            for block in self.iter_blocks(file_path):
+                yield file_path, block
+
+    def scan_content(self, content: str) -> Tuple[List[CodeBlock], Optional[str]]:
+        """Extract all code blocks and the title from content in a single pass."""
+        scanner = LineScanner(self)
+        fenced_blocks = []
+        indented_blocks = []
+        with self.timer.stage('scan'):
+            for kind, block in scanner.scan(content.split('\n'), content):
+                if kind == 'fenced':
+                    fenced_blocks.append(block)
+                else:
+                    indented_blocks.append(block)
+        with self.timer.stage('dedup'):
+            return self._merge_blocks(fenced_blocks, indented_blocks), scanner.title
+
     def extract_code_blocks(self, content: str) -> List[CodeBlock]:
         """Extract all code blocks from content."""
-        code_blocks = []
-        
-        # Extract markdown fenced code blocks
-        code_blocks.extend(self.extract_markdown_code_blocks(content))
-        
-        # Extract indented code blocks (but avoid duplicates)
-        indented_blocks = self.extract_indented_code_blocks(content)
-        
-        # Filter out indented blocks that overlap with fenced blocks
-        for indented_block in indented_blocks:
-            is_duplicate = False
-            for existing_block in code_blocks:
-                # Simple overlap detection
-                if (abs(indented_block.start_line - existing_block.start_line) < 5 and
-                    indented_block.content in existing_block.content):
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                code_blocks.append(indented_block)
-        
+        code_blocks, _ = self.scan_content(content)
         return code_blocks
-    
-    def generate_topic_name(self, file_path: str, content: str) -> str:
-        """Generate a topic name based on file path and content."""
+
+    def generate_topic_name(self, file_path: str, content: str, title: Optional[str] = None) -> str:
+        """Generate a topic name based on file path and content.
+
+        ``title`` is the raw title found by a previous scan of ``content``;
+        when omitted the content is searched for titles and headers.
+        """
         file_stem = Path(file_path).stem
-        
-        # Try to extract topic from content (look for titles, headers)
-        title_patterns = [
-            r'^#\s+(.+)$',  # Markdown h1
-            r'^##\s+(.+)$',  # Markdown h2
-            r'^Title:\s*(.+)$',  # Title: format
-            r'^Subject:\s*(.+)$',  # Subject: format
-        ]
-        
-        for pattern in title_patterns:
-            match = re.search(pattern, content, re.MULTILINE | re.IGNORECASE)
-            if match:
-                topic = re.sub(r'[^\w\s-]', '', match.group(1)).strip()
-                topic = re.sub(r'\s+', '_', topic)
-                return topic[:50]  # Limit length
-        
+
+        if title is None:
+            # Try to extract topic from content (look for titles, headers)
+            for pattern in TITLE_PATTERNS:
+                match = re.search(pattern.pattern, content, re.MULTILINE | pattern.flags)
+                if match:
+                    title = match.group(1)
+                    break
+
+        if title is not None:
+            topic = re.sub(r'[^\w\s-]', '', title).strip()
+            topic = re.sub(r'\s+', '_', topic)
+            return topic[:50]  # Limit length
+
         # Fall back to filename
         return file_stem or 'unknown_topic'
+
+    def block_filename(self, code_block: CodeBlock, index: int) -> str:
+        """Name of the file for the ``index``-th code block of a topic."""
+        if code_block.language and code_block.language != 'txt':
+            return f"code_{index:02d}_{code_block.language}_{code_block.hash}{code_block.get_file_extension()}"
+        return f"code_{index:02d}_{code_block.hash}{code_block.get_file_extension()}"
     
     def save_code_block(self, code_block: CodeBlock, topic_dir: Path, index: int) -> str:
-        """Save a code block to file."""
-        # Generate filename
-        if code_block.language and code_block.language != 'txt':
-            filename = f"code_{index:02d}_{code_block.language}_{code_block.hash}{code_block.get_file_extension()}"
-        else:
-            filename = f"code_{index:02d}_{code_block.hash}{code_block.get_file_extension()}"
-        
-        file_path = topic_dir / filename
+        """Save a code block to file.
+
+        The file is written by the extractor's writer, possibly in the
+        background or into an archive; it is complete once flush() returns.
+        """
+        file_path = topic_dir / self.block_filename(code_block, index)
+        return format_location(self.writer.write(file_path, code_block.content))
+    
+    def extract_file(self, file_path: str, known_hash: Optional[str] = None) -> Dict:
+        """Read a file and extract its code blocks and topic, without writing anything.
+
+        The result's ``source`` describes the file as read, with its content
+        hash if need_source_hash is set or ``known_hash`` given. When the
+        hash equals ``known_hash`` the file is not parsed and the result is
+        marked ``unchanged``.
+        """
+        with self.timer.stage('read'):
+            try:
+                with open(file_path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    if st.st_size > self.config.streaming_threshold:
+                        return self._extract_streaming(file_path, f, st, known_hash)
+                    data = f.read()
+            except Exception as e:
+                return {'error': f"Failed to read file: {e}"}
+            
+            source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+            if self.need_source_hash or known_hash is not None:
+                source['hash'] = self.config.new_hash(data).hexdigest()
+                if source['hash'] == known_hash:
+                    return {'message': 'Unchanged, skipped', 'unchanged': True, 'source': source}
+            
+            # Most prose and logs are rejected here, without decoding
+            if not may_contain_code(data):
+                return {'message': 'No code blocks found', 'source': source}
+            
+            try:
+                content = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                return {'error': f"Failed to read file: {e}"}
+            
+            if '\r' in content:
+                # Universal newlines, as when reading in text mode
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
         
-        # Create directory if it doesn't exist
-        topic_dir.mkdir(parents=True, exist_ok=True)
+        # Extract code blocks and title in a single pass
+        code_blocks, title = self.scan_content(content)
         
-        # Write the code block
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(code_block.content)
+        if not code_blocks:
+            return {'message': 'No code blocks found', 'source': source}
         
-        return str(file_path)
+        with self.timer.stage('topic'):
+            topic = self.generate_topic_name(file_path, content, title)
+        return {
+            'topic': topic,
+            'code_blocks': code_blocks,
+            'source': source
+        }
     
-    def process_file(self, file_path: str) -> Dict:
-        """Process a single file and extract code blocks."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except Exception as e:
-            return {'error': f"Failed to read file: {e}"}
+    def _extract_streaming(self, file_path: str, f, st: os.stat_result,
+                           known_hash: Optional[str] = None) -> Dict:
+        """Extract from an open file in chunks, for files too large to read at once.
+
+        Block contents are spooled to a temporary file as blocks close, so
+        memory use is bounded by the largest block rather than the file.
+        The spool's path is returned as ``spool``; save_extraction removes it.
+        Reading chunks is interleaved with scanning them, so it is timed as
+        part of the 'scan' stage.
+        """
+        source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        hashed = self.need_source_hash or known_hash is not None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            has_code = may_contain_code(data)
+            if known_hash is not None or (hashed and not has_code):
+                # Hash first, so an unchanged file or one without code is not parsed
+                source['hash'] = self.config.new_hash(data).hexdigest()
+                if source['hash'] == known_hash:
+                    return {'message': 'Unchanged, skipped', 'unchanged': True, 'source': source}
+            if not has_code:
+                return {'message': 'No code blocks found', 'source': source}
         
-        # Extract code blocks
-        code_blocks = self.extract_code_blocks(content)
+        digest = self.config.new_hash() if hashed else None
+        scanner = LineScanner(self, FENCE_SPILL_SIZE)
+        spool = BlockSpool()
+        try:
+            fenced_blocks = []
+            indented_blocks = []
+            with self.timer.stage('scan'):
+                for kind, block in scanner.scan(iter_text_lines(f, digest)):
+                    if kind == 'fenced':
+                        fenced_blocks.append(spool.add(block))
+                    else:
+                        indented_blocks.append(spool.add(block))
+                spool.close()
+            if digest is not None:
+                source['hash'] = digest.hexdigest()
+            with self.timer.stage('dedup'):
+                code_blocks = self._merge_blocks(fenced_blocks, indented_blocks)
+        except BaseException:
+            spool.remove()
+            raise
         
         if not code_blocks:
-            return {'message': 'No code blocks found'}
+            spool.remove()
+            return {'message': 'No code blocks found', 'source': source}
         
-        # Generate topic name
-        topic_name = self.generate_topic_name(file_path, content)
+        with self.timer.stage('topic'):
+            # Every line was scanned for titles, so there is no content left to search
+            topic = self.generate_topic_name(file_path, '', scanner.title)
+        return {
+            'topic': topic,
+            'code_blocks': code_blocks,
+            'source': source,
+            'spool': spool.path
+        }
+    
+    def _extract_timed(self, file_path: str, known_hash: Optional[str] = None) -> Dict:
+        """extract_file, returning the time its stages took as ``stages`` instead of adding it to the timer.
+
+        save_extraction adds them, wherever the file was extracted.
+        """
+        timer, self.timer = self.timer, StageTimer()
+        try:
+            result = self.extract_file(file_path, known_hash)
+        finally:
+            stages, self.timer = self.timer.snapshot(), timer
+        result['stages'] = stages
+        return result
+
+    def save_extraction(self, file_path: str, extraction: Dict) -> Dict:
+        """Save the code blocks and metadata of an extract_file result."""
+        before = self.timer.snapshot() if self.metrics is not None else None
+        if 'stages' in extraction:
+            self.timer.merge(extraction.pop('stages'))
+        result = self._save_extraction(file_path, extraction)
+        if self.metrics is not None:
+            self.metrics.observe(extraction, self.timer.since(before))
+        return result
+
+    def _save_extraction(self, file_path: str, extraction: Dict) -> Dict:
+        """Save an extraction, once its worker's stage times have been added."""
+        if 'code_blocks' not in extraction:
+            if extraction.get('unchanged'):
+                self.stats['files_unchanged'] += 1
+            elif 'source' in extraction:
+                # Read but without code: drop what earlier runs stored for it
+                for sink in self.sinks:
+                    sink.clear_source(file_path, extraction['source'])
+            if self.manifest is not None and 'source' in extraction:
+                self.manifest.update(file_path, extraction['source'])
+            return extraction
+        
+        code_blocks = extraction['code_blocks']
+        topic_name = extraction['topic']
         topic_dir = self.output_dir / topic_name
         
+        for sink in self.sinks:
+            sink.add_source(file_path, topic_name, extraction['source'])
+        
         # Save code blocks
         saved_files = []
-        for i, code_block in enumerate(code_blocks, 1):
-            saved_path = self.save_code_block(code_block, topic_dir, i)
-            saved_files.append({
-                'path': saved_path,
-                'language': code_block.language,
-                'lines': len(code_block.content.split('\n')),
-                'hash': code_block.hash
-            })
-            
-            # Update stats
-            self.stats['languages_detected'].add(code_block.language)
+        small_blocks = []
+        archive_path = topic_dir / self.SMALL_BLOCKS_ARCHIVE
+        with self.timer.stage('write'):
+            try:
+                for i, code_block in enumerate(code_blocks, 1):
+                    content = code_block.content
+                    if self.block_store is not None:
+                        saved = dict(self.block_store.save(code_block))
+                        self.block_store.add_source(code_block, file_path, topic_name)
+                    elif self.output_format == 'dir' and len(content) < self.config.coalesce_block_size:
+                        filename = self.block_filename(code_block, i)
+                        small_blocks.append((filename, content))
+                        saved = {'path': str(archive_path), 'member': filename}
+                    else:
+                        saved = self.writer.write(topic_dir / self.block_filename(code_block, i), content)
+                    saved.update({
+                        'language': code_block.language,
+                        'confidence': round(code_block.confidence, 2),
+                        'lines': content.count('\n') + 1,
+                        'hash': code_block.hash
+                    })
+                    saved_files.append(saved)
+                    for sink in self.sinks:
+                        sink.add_block(file_path, topic_name, code_block, content)
+                    
+                    # Update stats
+                    self.stats['languages_detected'].add(code_block.language)
+            finally:
+                if 'spool' in extraction:
+                    os.remove(extraction['spool'])
+            if small_blocks:
+                self.writer.write_archive(archive_path, small_blocks)
         
         # Save metadata
-        metadata_path = topic_dir / 'metadata.json'
-        metadata = {
-            'source_file': str(file_path),
-            'topic': topic_name,
-            'total_blocks': len(code_blocks),
-            'code_files': saved_files,
-            'processed_at': str(Path().cwd())
-        }
-        
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2)
+        with self.timer.stage('metadata'):
+            metadata_path = topic_dir / 'metadata.json'
+            metadata = {
+                'source_file': str(file_path),
+                'topic': topic_name,
+                'total_blocks': len(code_blocks),
+                'code_files': saved_files,
+                'processed_at': str(Path().cwd())
+            }
+            # Written only once the files it lists are
+            written = [Path(saved['path']) for saved in saved_files]
+            metadata_location = self.writer.write(metadata_path, json.dumps(metadata, indent=2),
+                                                  after=dict.fromkeys(written))
+            for sink in self.sinks:
+                sink.end_source(file_path)
+            
+            if self.manifest is not None:
+                self.manifest.update(file_path, extraction['source'])
         
         # Update stats
         self.stats['files_processed'] += 1
@@ -280,56 +1802,574 @@ class CodeExtractor:
             'topic': topic_name,
             'blocks_extracted': len(code_blocks),
             'files_created': saved_files,
-            'metadata_file': str(metadata_path)
+            'metadata_file': format_location(metadata_location)
         }
     
+    def _check_manifest(self, file_path: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """Return a result for a file the manifest shows as unchanged, or its known hash."""
+        if self.manifest is None:
+            return None, None
+        unchanged, known_hash = self.manifest.is_unchanged(file_path)
+        if unchanged:
+            return {'message': 'Unchanged, skipped', 'unchanged': True}, None
+        return None, known_hash
+    
+    def process_file(self, file_path: str, source_path: Optional[str] = None) -> Dict:
+        """Process a single file and extract code blocks.
+
+        The file is recorded (in metadata, the manifest and sinks) as
+        ``source_path``, by default its own path, e.g. where it will be
+        moved once processed.
+        """
+        source_path = source_path or file_path
+        skipped, known_hash = self._check_manifest(source_path)
+        if skipped:
+            return self.save_extraction(source_path, skipped)
+        return self.save_extraction(source_path, self._extract_timed(file_path, known_hash))
+    
+    def process_files(self, file_paths: Iterable[str], jobs: int = 1,
+                      source_paths: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, Dict]]:
+        """Process files, yielding ``(file_path, result)`` pairs in input order.
+
+        With ``jobs`` > 1 files are extracted by a pool of worker processes
+        while results are saved, and stats updated, here in input order, so
+        the output does not depend on which worker finishes first.
+        ``source_paths`` maps files to the path to record them as, as in
+        process_file.
+        """
+        source_paths = source_paths or {}
+        if jobs == 1:
+            for file_path in file_paths:
+                yield file_path, self.process_file(file_path, source_paths.get(file_path))
+            return
+        
+        # The pool is kept for later calls, until close()
+        if self._executor is None or self._executor_jobs != jobs:
+            self.shutdown_workers()
+            self._executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                 initargs=(self.config, self.need_source_hash))
+            self._executor_jobs = jobs
+        
+        pending = deque()
+        for file_path in file_paths:
+            skipped, known_hash = self._check_manifest(source_paths.get(file_path, file_path))
+            if skipped:
+                future = Future()
+                future.set_result(skipped)
+            else:
+                future = self._executor.submit(_extract_in_worker, file_path, known_hash)
+            pending.append((file_path, future))
+            # Keep a bounded number of files in flight
+            if len(pending) >= jobs * 4:
+                file_path, future = pending.popleft()
+                yield file_path, self.save_extraction(source_paths.get(file_path, file_path), future.result())
+        while pending:
+            file_path, future = pending.popleft()
+            yield file_path, self.save_extraction(source_paths.get(file_path, file_path), future.result())
+    
+    def shutdown_workers(self):
+        """Stop the worker processes started by process_files, if any."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._executor_jobs = 0
+    
+    def flush(self):
+        """Finish pending writes and flush state kept across files, such as the manifest."""
+        with self.timer.stage('write'):
+            self.writer.flush()
+            for sink in self.sinks:
+                sink.flush()
+        with self.timer.stage('metadata'):
+            if self.manifest is not None:
+                self.manifest.close()
+            if self.block_store is not None:
+                self.block_store.close()
+        if self.metrics is not None:
+            self.metrics.flush()
+    
+    def close(self):
+        """Flush state and stop worker processes and writer threads."""
+        self.flush()
+        self.writer.close()
+        for sink in self.sinks:
+            sink.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        self.shutdown_workers()
+    
     def get_stats(self) -> Dict:
-        """Get processing statistics."""
+        """Get processing statistics.
+
+        ``stages`` gives the calls, wall-clock and CPU seconds of each stage,
+        summed over worker processes.
+        """
         stats = dict(self.stats)
-        stats['languages_detected'] = list(stats['languages_detected'])
-        stats['topics_created'] = list(stats['topics_created'])
+        stats['languages_detected'] = sorted(stats['languages_detected'])
+        stats['topics_created'] = sorted(stats['topics_created'])
+        stats['stages'] = self.timer.snapshot()
         return stats
 
 
+class DirectoryWatcher:
+    """Waits for files to arrive in a directory.
+
+    Uses inotify (through libc with ctypes) where available, and otherwise
+    polls the directory's mtime, which changes whenever an entry is added
+    or renamed into it. Events arriving in a burst are batched: after the
+    first one the watcher waits until the directory has been quiet for
+    ``settle`` seconds.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory: str, poll_interval: float = 0.5, settle: float = 0.05,
+                 max_settle: float = 1.0):
+        self.directory = str(directory)
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.max_settle = max_settle
+        self._fd = self._init_inotify()
+        self._mtime = self._directory_mtime()
+
+    @property
+    def mechanism(self) -> str:
+        return 'inotify' if self._fd is not None else 'polling'
+
+    def _init_inotify(self) -> Optional[int]:
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory),
+                                  self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _directory_mtime(self) -> int:
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _drain(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` for inotify events and discard them."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def _poll(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` for the directory's mtime to change."""
+        deadline = time.monotonic() + timeout
+        while True:
+            mtime = self._directory_mtime()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def wait(self, timeout: float) -> bool:
+        """Block until files arrive or ``timeout`` seconds pass; return whether any arrived."""
+        check = self._drain if self._fd is not None else self._poll
+        if not check(timeout):
+            return False
+        deadline = time.monotonic() + self.max_settle
+        while time.monotonic() < deadline and check(self.settle):
+            pass
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class QueueRunner:
+    """Ingest service moving files through Queue/, InProgress/ and Complete/ under a root.
+
+    Files are claimed by renaming them from Queue/ into InProgress/, which is
+    atomic, extracted, and then renamed into Complete/ (or Failed/ when they
+    could not be read). Only one runner may use a root at a time; anything
+    left in InProgress/ when it starts was interrupted by a crash and is put
+    back into Queue/.
+    """
+
+    QUEUE = 'Queue'
+    IN_PROGRESS = 'InProgress'
+    COMPLETE = 'Complete'
+    FAILED = 'Failed'
+    LOCK_FILE = '.queue.lock'
+
+    def __init__(self, extractor: CodeExtractor, root: str, jobs: int = 1, batch_size: int = 64,
+                 watch: bool = False):
+        self.extractor = extractor
+        self.root = Path(root)
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.stopping = False
+        self._lock_file = None
+        for name in (self.QUEUE, self.IN_PROGRESS, self.COMPLETE, self.FAILED):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+        # Set up before the first scan so no arrival is missed
+        self.watcher = DirectoryWatcher(self.root / self.QUEUE) if watch else None
+
+    def lock(self):
+        """Take the root's lock, raising RuntimeError if another runner holds it."""
+        self._lock_file = open(self.root / self.LOCK_FILE, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                raise RuntimeError(f"another queue runner is using {self.root}")
+
+    def unlock(self):
+        """Release the root's lock and stop watching the queue."""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self.watcher is not None:
+            self.watcher.close()
+
+    @staticmethod
+    def _is_candidate(name: str) -> bool:
+        # Hidden and partial files are still being written by their producer
+        return not name.startswith('.') and not name.endswith(('.tmp', '.part', '.partial'))
+
+    def _move(self, path: Path, directory: str, avoid: Iterable[str] = ()) -> Path:
+        """Rename ``path`` into ``directory`` without overwriting anything there.
+
+        The name is also kept unused in the ``avoid`` directories.
+        """
+        directories = [self.root / name for name in (directory, *avoid)]
+        name = path.name
+        counter = 1
+        while any((parent / name).exists() for parent in directories):
+            name = f"{path.name}.{counter}"
+            counter += 1
+        target = self.root / directory / name
+        os.rename(path, target)
+        return target
+
+    def recover(self) -> List[Path]:
+        """Put files left in InProgress/ by an interrupted run back into Queue/."""
+        recovered = []
+        with os.scandir(self.root / self.IN_PROGRESS) as it:
+            for entry in sorted(it, key=lambda entry: entry.name):
+                if entry.is_file() and self._is_candidate(entry.name):
+                    recovered.append(self._move(Path(entry.path), self.QUEUE))
+        return recovered
+
+    def claim(self) -> List[Path]:
+        """Claim up to ``batch_size`` queued files, oldest first, by moving them to InProgress/."""
+        with os.scandir(self.root / self.QUEUE) as it:
+            entries = [entry for entry in it if entry.is_file() and self._is_candidate(entry.name)]
+        entries.sort(key=lambda entry: (entry.stat().st_mtime_ns, entry.name))
+
+        claimed = []
+        for entry in entries[:self.batch_size]:
+            try:
+                # A name unused in Complete/, so the file keeps it there
+                claimed.append(self._move(Path(entry.path), self.IN_PROGRESS, (self.COMPLETE, self.FAILED)))
+            except FileNotFoundError:
+                continue  # Removed by its producer in the meantime
+        return claimed
+
+    def process_batch(self) -> Iterator[Tuple[str, Dict]]:
+        """Claim and process one batch, yielding ``(file_path, result)`` pairs."""
+        claimed = self.claim()
+        if not claimed:
+            return
+        # Sources are recorded under the path they will have in Complete/, not the transient InProgress/ one
+        source_paths = {str(path): str(self.root / self.COMPLETE / path.name) for path in claimed}
+        results = list(self.extractor.process_files(map(str, claimed), self.jobs, source_paths))
+        # Sources only leave InProgress once everything extracted from them is written
+        self.extractor.flush()
+        for file_path, result in results:
+            done = self.FAILED if 'error' in result else self.COMPLETE
+            result['queue_path'] = str(self._move(Path(file_path), done))
+            yield file_path, result
+
+    def run(self, poll_interval: float = 2.0, once: bool = False) -> Iterator[Tuple[str, Dict]]:
+        """Process queued files until stopped, yielding ``(file_path, result)`` pairs.
+
+        With ``once`` the runner stops as soon as the queue is empty. The
+        caller must hold the root's lock. With a watcher, an empty queue is
+        only scanned again once files arrive; ``poll_interval`` then just
+        bounds how long a stop request can go unnoticed.
+        """
+        self.recover()
+        scan = True
+        while not self.stopping:
+            processed = 0
+            if scan:
+                for item in self.process_batch():
+                    processed += 1
+                    yield item
+            if processed:
+                continue
+            if once:
+                break
+            if self.watcher is not None:
+                scan = self.watcher.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def stop(self, *args):
+        """Ask the runner to stop after the current batch (usable as a signal handler)."""
+        self.stopping = True
+
+
+def walk_files(directory: str, extensions: Iterable[str] = (), exclude: Iterable[str] = ()) -> Iterator[str]:
+    """Lazily yield files below ``directory`` whose extension is in ``extensions``.
+
+    Directories are read one at a time with ``os.scandir``; hidden entries,
+    symlinked directories and the directories in ``exclude`` are skipped.
+    An empty ``extensions`` accepts every file.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    excluded = {os.path.realpath(path) for path in exclude}
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error: Cannot read directory {current}: {e}")
+            continue
+        
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if os.path.realpath(entry.path) not in excluded:
+                    subdirectories.append(entry.path)
+            elif entry.is_file() and (not extensions or entry.name.lower().endswith(extensions)):
+                yield entry.path
+        # Visit subdirectories in name order after this directory's files
+        stack.extend(reversed(subdirectories))
+
+
+_worker_extractor = None
+
+
+def _init_worker(config: ExtractorConfig, need_source_hash: bool = False):
+    """Create the extractor used by a worker process."""
+    global _worker_extractor
+    _worker_extractor = CodeExtractor(config=config)
+    _worker_extractor.need_source_hash = need_source_hash
+
+
+def _extract_in_worker(file_path: str, known_hash: Optional[str] = None) -> Dict:
+    """Extract code blocks from one file in a worker process."""
+    try:
+        return _worker_extractor._extract_timed(file_path, known_hash)
+    except Exception as e:
+        return {'error': f"Failed to extract code blocks: {e}"}
+
+
+def print_result(file_path: str, result: Dict, verbose: bool = False):
+    """Print the outcome of processing one file."""
+    if 'error' in result:
+        print(f"Error processing {file_path}: {result['error']}")
+    elif 'message' in result:
+        if verbose or not result.get('unchanged'):
+            print(f"{file_path}: {result['message']}")
+    else:
+        print(f"✓ {file_path} -> {result['topic']} ({result['blocks_extracted']} code blocks)")
+        if verbose:
+            for file_info in result['files_created']:
+                print(f"  - {format_location(file_info)} ({file_info['language']}, {file_info['lines']} lines)")
+
+
+def print_profile(stages: Dict[str, Dict]):
+    """Print the time spent in each stage, as returned in get_stats()['stages']."""
+    total = sum(stage['wall'] for stage in stages.values()) or 1.0
+    print(f"\n--- Stage Profile ---")
+    print(f"{'stage':<10} {'calls':>8} {'wall s':>9} {'cpu s':>9} {'wall %':>7}")
+    for name, stage in stages.items():
+        print(f"{name:<10} {stage['calls']:>8} {stage['wall']:>9.3f} {stage['cpu']:>9.3f} "
+              f"{stage['wall'] / total:>7.1%}")
+
+
 def main():
     parser = argparse.ArgumentParser(description='Extract code blocks from files')
-    parser.add_argument('files', nargs='+', help='Files to process')
-    parser.add_argument('-o', '--output', default='extracted_code', 
-                       help='Output directory (default: extracted_code)')
+    parser.add_argument('files', nargs='*',
+                       help='Files to process; quoted glob patterns are expanded, and directories with -r')
+    parser.add_argument('-o', '--output',
+                       help='Output directory (default: output_directory from the config, extracted_code)')
     parser.add_argument('-v', '--verbose', action='store_true',
                        help='Verbose output')
+    parser.add_argument('--config',
+                       help='JSON config overriding settings from the bundled config.json')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                       help='Process files with a supported extension inside directories, recursively')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Skip files unchanged since they were last processed into the output directory')
+    parser.add_argument('--content-addressed', action='store_true',
+                       help='Store each distinct code block once under OUTPUT/blocks, '
+                            'referenced from the topic metadata')
+    parser.add_argument('--output-format', choices=('dir',) + ArchiveWriter.FORMATS, default='dir',
+                       help='Write loose files (dir, the default) or one tar or zip archive per run '
+                            'into the output directory')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default='none',
+                       help='Force output to disk: never (none, the default), when a run or queue batch '
+                            'is flushed (batch), or after every file (always)')
+    parser.add_argument('--jsonl', metavar='FILE',
+                       help='Also append a JSON line per code block to FILE, or to stdout with "-" '
+                            '(other output then goes to stderr)')
+    parser.add_argument('--sqlite', metavar='DATABASE',
+                       help='Also store sources and code blocks in a SQLite database')
+    parser.add_argument('--write-threads', type=int, default=4,
+                       help='Threads writing output files, 0 to write synchronously (default: 4)')
+    parser.add_argument('--profile', action='store_true',
+                       help='Print the time spent in each stage of extraction after the summary')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                       help='Serve Prometheus metrics over HTTP at /metrics on PORT')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                       help='Address to serve metrics on (default: 127.0.0.1)')
+    parser.add_argument('--metrics-file', metavar='FILE',
+                       help='Keep FILE updated with Prometheus metrics, for a textfile collector')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                       help='Number of worker processes, 0 for one per CPU (default: 1)')
+    parser.add_argument('--queue-root',
+                       help='Run as a service processing files dropped into QUEUE_ROOT/Queue')
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                       help='Seconds between checks of an empty queue (default: 2)')
+    parser.add_argument('--once', action='store_true',
+                       help='With --queue-root, stop once the queue is empty')
+    parser.add_argument('--watch', action='store_true',
+                       help='With --queue-root, react to new files with inotify (or mtime polling) '
+                            'instead of rescanning the queue every poll interval')
     
     args = parser.parse_args()
+    if not args.files and not args.queue_root:
+        parser.error("no files given (or use --queue-root)")
+    if args.watch and not args.queue_root:
+        parser.error("--watch requires --queue-root")
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+    if args.write_threads < 0:
+        parser.error("--write-threads must be 0 or more")
+    jobs = args.jobs or os.cpu_count() or 1
     
-    extractor = CodeExtractor(args.output)
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, KeyError, re.error) as e:
+        parser.error(f"invalid config {args.config or DEFAULT_CONFIG_PATH}: {e}")
     
-    for file_path in args.files:
-        if not os.path.exists(file_path):
-            print(f"Error: File not found: {file_path}")
-            continue
-        
-        if args.verbose:
-            print(f"Processing: {file_path}")
-        
-        result = extractor.process_file(file_path)
-        
-        if 'error' in result:
-            print(f"Error processing {file_path}: {result['error']}")
-        elif 'message' in result:
-            print(f"{file_path}: {result['message']}")
-        else:
-            print(f"✓ {file_path} -> {result['topic']} ({result['blocks_extracted']} code blocks)")
+    sinks = []
+    try:
+        if args.jsonl:
+            sinks.append(JsonlSink(args.jsonl))
+        if args.sqlite:
+            sinks.append(SqliteSink(args.sqlite))
+    except (OSError, sqlite3.Error) as e:
+        parser.error(f"cannot open output: {e}")
+    
+    metrics = None
+    if args.metrics_port is not None or args.metrics_file:
+        try:
+            metrics = Metrics(args.metrics_port, args.metrics_file, args.metrics_host)
+        except OSError as e:
+            parser.error(f"cannot serve metrics: {e}")
+    
+    extractor = CodeExtractor(args.output, config, incremental=args.incremental,
+                              content_addressed=args.content_addressed, write_threads=args.write_threads,
+                              output_format=args.output_format, sinks=sinks, fsync=args.fsync,
+                              metrics=metrics)
+    
+    def input_paths():
+        for path in args.files:
+            if not os.path.exists(path) and any(char in path for char in '*?['):
+                # Patterns are expanded here, lazily, instead of by the shell
+                matches = glob.iglob(path, recursive=True)
+            else:
+                matches = [path]
+            matched = False
+            for match in matches:
+                matched = True
+                if os.path.isdir(match):
+                    if not args.recursive:
+                        print(f"Error: {match} is a directory (use -r to process directories)")
+                        continue
+                    yield from walk_files(match, config.supported_extensions, [extractor.output_dir])
+                else:
+                    yield match
+            if not matched:
+                print(f"Error: File not found: {path}")
+    
+    def existing_files():
+        for file_path in input_paths():
+            if not os.path.exists(file_path):
+                print(f"Error: File not found: {file_path}")
+                continue
+            
             if args.verbose:
-                for file_info in result['files_created']:
-                    print(f"  - {file_info['path']} ({file_info['language']}, {file_info['lines']} lines)")
+                print(f"Processing: {file_path}")
+            yield file_path
+    
+    # With --jsonl -, stdout carries the JSON lines and messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr if args.jsonl == '-' else sys.stdout):
+        if args.verbose and metrics is not None and metrics.address is not None:
+            host, port = metrics.address
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+        runner = None
+        if args.queue_root:
+            runner = QueueRunner(extractor, args.queue_root, jobs, watch=args.watch)
+            if args.verbose and runner.watcher is not None:
+                print(f"Watching {runner.root / runner.QUEUE} using {runner.watcher.mechanism}")
+            try:
+                runner.lock()
+            except RuntimeError as e:
+                print(f"Error: {e}")
+                sys.exit(1)
+            signal.signal(signal.SIGTERM, runner.stop)
+            signal.signal(signal.SIGINT, runner.stop)
+            results = runner.run(args.poll_interval, args.once)
+        else:
+            results = extractor.process_files(existing_files(), jobs)
+    
+        try:
+            for file_path, result in results:
+                print_result(file_path, result, args.verbose)
+        finally:
+            extractor.close()
+            if runner is not None:
+                runner.unlock()
     
-    # Print final stats
-    stats = extractor.get_stats()
-    print(f"\n--- Processing Summary ---")
-    print(f"Files processed: {stats['files_processed']}")
-    print(f"Code blocks found: {stats['code_blocks_found']}")
-    print(f"Topics created: {len(stats['topics_created'])}")
-    print(f"Languages detected: {', '.join(stats['languages_detected'])}")
+        # Print final stats
+        stats = extractor.get_stats()
+        print(f"\n--- Processing Summary ---")
+        print(f"Files processed: {stats['files_processed']}")
+        if args.incremental:
+            print(f"Files unchanged: {stats['files_unchanged']}")
+        print(f"Code blocks found: {stats['code_blocks_found']}")
+        print(f"Topics created: {len(stats['topics_created'])}")
+        print(f"Languages detected: {', '.join(stats['languages_detected'])}")
+        if args.profile:
+            print_profile(stats['stages'])
 
 
 if __name__ == '__main__':
@@ -14,7 +14,7 @@ if [ ! -f "$EXTRACTOR_SCRIPT" ]; then
     exit 1
 fi
 
-# Check if files were provided
+# Check if files (or options) were provided
 if [ $# -eq 0 ]; then
     echo "Code Block Extractor"
     echo "Usage: $0 [options] file1 [file2 ...]"
@@ -22,12 +22,29 @@ if [ $# -eq 0 ]; then
     echo "Options:"
     echo "  -o, --output DIR    Output directory (default: extracted_code)"
     echo "  -v, --verbose       Verbose output"
+    echo "  --config FILE       JSON config overriding the bundled config.json"
+    echo "  -r, --recursive     Process supported files inside directories"
+    echo "  --incremental       Skip files unchanged since the last run"
+    echo "  --content-addressed Store each distinct code block once under OUTPUT/blocks"
+    echo "  --output-format F   dir (default), or one tar or zip archive per run"
+    echo "  --jsonl FILE        Also write a JSON line per code block to FILE (- for stdout)"
+    echo "  --sqlite DATABASE   Also store sources and code blocks in a SQLite database"
+    echo "  --fsync POLICY      Force output to disk: none (default), batch or always"
+    echo "  --write-threads N   Threads writing output files, 0 for none (default: 4)"
+    echo "  -j, --jobs N        Worker processes, 0 for one per CPU (default: 1)"
+    echo "  --profile           Print the time spent in each stage of extraction"
+    echo "  --metrics-port PORT Serve Prometheus metrics at http://127.0.0.1:PORT/metrics"
+    echo "  --metrics-file FILE Keep FILE updated with Prometheus metrics"
+    echo "  --queue-root DIR    Process files dropped into DIR/Queue as a service"
+    echo "  --once              With --queue-root, stop once the queue is empty"
+    echo "  --watch             With --queue-root, wait for new files instead of polling"
     echo "  -h, --help          Show this help"
     echo ""
     echo "Examples:"
     echo "  $0 conversation.md"
     echo "  $0 -v -o my_code conversation1.md conversation2.md"
     echo "  $0 *.md *.txt"
+    echo "  $0 -r -j 0 exports/"
     exit 0
 fi
 